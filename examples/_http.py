@@ -0,0 +1,26 @@
+"""Shared http client and dataset cache for the example scripts."""
+
+import atexit
+from pathlib import Path
+
+import httpx
+
+# one keep-alive connection pool for all downloads of the examples
+http = httpx.Client(timeout=30.0, limits=httpx.Limits(max_keepalive_connections=20))
+atexit.register(http.close)
+
+IRIS_URL = "https://archive.ics.uci.edu/ml/machine-learning-databases/iris/iris.data"
+IRIS_CACHE = Path.home() / ".cache" / "codeboxapi" / "iris.data"
+
+
+def cached_iris() -> Path:
+    """Download the iris dataset once and reuse it on later runs."""
+    if not IRIS_CACHE.exists():
+        IRIS_CACHE.parent.mkdir(parents=True, exist_ok=True)
+        partial = IRIS_CACHE.with_suffix(".part")
+        with http.stream("GET", IRIS_URL) as response, partial.open("wb") as f:
+            response.raise_for_status()
+            for chunk in response.iter_bytes(chunk_size=65536):
+                f.write(chunk)
+        partial.replace(IRIS_CACHE)
+    return IRIS_CACHE
@@ -14,9 +14,8 @@ async def train_model(codebox: CodeBox, data_split: int) -> dict:
     # Upload dataset
     await codebox.aupload(file.name, file.read_bytes())
 
-    # Install required packages
-    await codebox.ainstall("pandas")
-    await codebox.ainstall("scikit-learn")
+    # Install required packages in a single round-trip
+    await codebox.ainstall("pandas", "scikit-learn")
 
     # Training code with different data splits
     code = f"""
@@ -54,19 +53,15 @@ print(f"Coefficients: {{model.coef_.tolist()}}")
 
 
 async def main():
-    # Create multiple Docker instances
+    # Create multiple Docker instances, they share one connection pool
     num_parallel = 4
     codeboxes = [CodeBox(api_key="docker") for _ in range(num_parallel)]
 
-    # Create tasks for different data splits
-    tasks = []
-    for i, codebox in enumerate(codeboxes):
-        task = asyncio.create_task(train_model(codebox, i))
-        tasks.append(task)
-
-    # Execute and time the parallel processing
+    # Execute and time the parallel processing, one training per container
     start_time = time.perf_counter()
-    results = await asyncio.gather(*tasks)
+    results = await asyncio.gather(
+        *(train_model(codebox, i) for i, codebox in enumerate(codeboxes))
+    )
     end_time = time.perf_counter()
 
     # Print results
@@ -1,18 +1,15 @@
-import httpx
+from _http import cached_iris
 
 from codeboxapi import CodeBox
 
 codebox = CodeBox()
 
-# upload dataset csv
-csv_bytes = httpx.get(
-    "https://archive.ics.uci.edu/ml/machine-learning-databases/iris/iris.data"
-).content
-codebox.upload("iris.csv", csv_bytes)
+# upload the (locally cached) dataset csv
+with cached_iris().open("rb") as f:
+    codebox.upload("iris.csv", f)
 
-# install openpyxl for excel conversion
-codebox.install("pandas")
-codebox.install("openpyxl")
+# install pandas and openpyxl for excel conversion in one go
+codebox.install("pandas", "openpyxl")
 
 # convert dataset csv to excel
 output = codebox.exec(
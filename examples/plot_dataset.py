@@ -1,21 +1,14 @@
-import base64
-from io import BytesIO
 from pathlib import Path
 
-import httpx
-from PIL import Image
+from _http import cached_iris
 
 from codeboxapi import CodeBox
 
 codebox = CodeBox(api_key="local")
 
-# download the iris dataset
-iris_csv_bytes = httpx.get(
-    "https://archive.ics.uci.edu/ml/machine-learning-databases/iris/iris.data"
-).content
-
-# upload the dataset to the codebox
-codebox.upload("iris.csv", iris_csv_bytes)
+# upload the (locally cached) iris dataset to the codebox
+with cached_iris().open("rb") as f:
+    codebox.upload("iris.csv", f)
 
 # dataset analysis code
 file_path = Path("examples/assets/dataset_code.txt")
@@ -24,12 +17,27 @@ file_path = Path("examples/assets/dataset_code.txt")
 output = codebox.exec(file_path)
 
 if output.images:
-    img_bytes = base64.b64decode(output.images[0])
-    img_buffer = BytesIO(img_bytes)
-
-    # Display the image
-    img = Image.open(img_buffer)
-    img.show()
+    # only pay for the image imports when there is an image to show
+    from concurrent.futures import ThreadPoolExecutor
+    from io import BytesIO
+
+    from PIL import Image
+
+    try:  # simd accelerated base64 decoding if available
+        from pybase64 import b64decode
+    except ImportError:
+        from base64 import b64decode
+
+    def decode_image(img_str: str) -> Image.Image:
+        # BytesIO wraps the decoded bytes without copying them
+        img = Image.open(BytesIO(b64decode(img_str)))
+        img.load()  # decode inside the worker thread
+        return img
+
+    # decode all returned plots in parallel and display them
+    with ThreadPoolExecutor() as pool:
+        for img in pool.map(decode_image, output.images):
+            img.show()
 
 elif output.errors:
     print("Error:", output.errors)
@@ -3,42 +3,58 @@ import time
 
 from codeboxapi import CodeBox, ExecChunk
 
+try:  # faster event loop for the async examples if available
+    import uvloop
 
-def sync_stream_exec(cb: CodeBox) -> None:
-    chunks: list[tuple[ExecChunk, float]] = []
-    t0 = time.perf_counter()
-    for chunk in cb.stream_exec(
-        "import time;\nfor i in range(3): time.sleep(1); print(i)"
-    ):
-        chunks.append((chunk, time.perf_counter() - t0))
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+except ImportError:
+    pass
 
+CODE = "import time;\nfor i in range(3): time.sleep(1); print(i)"
+
+
+def print_timings(label: str, chunks: list[tuple[ExecChunk, int]]) -> None:
     for chunk, t in chunks:
-        print(f"{t:.5f}: {chunk}")
+        print(f"{label} {t / 1e9:.5f}: {chunk}")
 
 
-async def async_stream_exec(cb: CodeBox) -> None:
-    chunks: list[tuple[ExecChunk, float]] = []
-    t0 = time.perf_counter()
-    async for chunk in cb.astream_exec(
-        "import time;\nfor i in range(3): time.sleep(1); print(i)"
-    ):
-        chunks.append((chunk, time.perf_counter() - t0))
+def sync_stream_exec(cb: CodeBox, label: str) -> None:
+    chunks: list[tuple[ExecChunk, int]] = []
+    t0 = time.perf_counter_ns()
+    for chunk in cb.stream_exec(CODE):
+        chunks.append((chunk, time.perf_counter_ns() - t0))
+    print_timings(label, chunks)
 
-    for chunk, t in chunks:
-        print(f"{t:.5f}: {chunk}")
 
+async def async_stream_exec(cb: CodeBox, label: str) -> None:
+    chunks: list[tuple[ExecChunk, int]] = []
+    t0 = time.perf_counter_ns()
+    async for chunk in cb.astream_exec(CODE):
+        chunks.append((chunk, time.perf_counter_ns() - t0))
+    print_timings(label, chunks)
+
+
+async def time_box(cb: CodeBox, name: str) -> None:
+    # both runs share one session, so they must not execute at the same time
+    await asyncio.to_thread(sync_stream_exec, cb, f"{name} sync")
+    await async_stream_exec(cb, f"{name} async")
+
+
+async def main() -> None:
+    # boot the docker container and warm up both sessions concurrently
+    remote, docker = await asyncio.gather(
+        asyncio.to_thread(CodeBox),
+        asyncio.to_thread(CodeBox, api_key="docker"),
+    )
+    await asyncio.gather(remote.ahealthcheck(), docker.ahealthcheck())
+
+    # remote and docker boxes are independent, so time them concurrently
+    await asyncio.gather(time_box(remote, "remote"), time_box(docker, "docker"))
 
-print("remote")
-cb = CodeBox()
-sync_stream_exec(cb)
-asyncio.run(async_stream_exec(cb))
 
-print("local")
+# local redirects the process stdout while executing, so it runs on its own
 local = CodeBox(api_key="local")
-sync_stream_exec(local)
-asyncio.run(async_stream_exec(local))
+sync_stream_exec(local, "local sync")
+asyncio.run(async_stream_exec(local, "local async"))
 
-print("docker")
-docker = CodeBox(api_key="docker")
-sync_stream_exec(docker)
-asyncio.run(async_stream_exec(docker))
+asyncio.run(main())
@@ -1,4 +1,5 @@
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
 from os import getenv, path
@@ -25,6 +26,12 @@ async def lifespan(_: FastAPI) -> t.AsyncGenerator[None, None]:
             await asyncio.sleep(1)
         exit(0)
 
+    # cells and file operations run in the default executor, a running cell holds
+    # a worker until it finishes so size the pool for concurrent requests
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=int(getenv("CODEBOX_THREAD_POOL_SIZE", "64")))
+    )
+    _ = codebox.shell  # build the IPython shell before the first request
     t = asyncio.create_task(timeout())
     yield
     t.cancel()
@@ -60,7 +67,7 @@ async def exec(
     return StreamingResponse(event_stream())
 
 
-@app.get("/files/download/{file_name}")
+@app.api_route("/files/download/{file_name}", methods=["GET", "HEAD"])
 async def download(
     file_name: str,
     timeout: t.Optional[int] = None,
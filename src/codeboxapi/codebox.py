@@ -35,19 +35,41 @@ Usage
 
 """
 
+import json
 import os
+import shlex
+import threading
+import time
 import typing as t
+from contextlib import suppress
 from importlib import import_module
+from operator import attrgetter
 
 import anyio
+from anyio.from_thread import BlockingPortal
 
-from .utils import async_flatten_exec_result, deprecated, flatten_exec_result, syncify
+from .utils import (
+    async_flatten_exec_result,
+    deprecated,
+    flatten_exec_result,
+    run_sync,
+    single_flight,
+)
 
 if t.TYPE_CHECKING:
     from .types import CodeBoxOutput, ExecChunk, ExecResult, RemoteFile
 
 
+HEALTHY_TTL = float(os.getenv("CODEBOX_HEALTH_TTL", "5"))  # seconds
+KEEP_ALIVE_INTERVAL = 60  # seconds
+
+
 class CodeBox:
+    _last_healthy = float("-inf")
+    _last_activity = float("-inf")
+    # scope of the running keep-alive, with the loop and thread that own it
+    _keep_alive: t.Optional[t.Tuple[anyio.CancelScope, BlockingPortal, int]] = None
+
     def __new__(cls, *args, **kwargs) -> "CodeBox":
         """
         Creates a CodeBox session
@@ -55,7 +77,7 @@ class CodeBox:
         api_key = kwargs.get("api_key") or os.getenv("CODEBOX_API_KEY")
         # todo make sure "local" is not hardcoded default
         if api_key == "local":
-            return import_module("codeboxapi.local").LocalBox(*args, **kwargs)
+            return import_module("codeboxapi.local").get_local_box(*args, **kwargs)
 
         if api_key == "docker":
             return import_module("codeboxapi.docker").DockerBox(*args, **kwargs)
@@ -72,6 +94,40 @@ class CodeBox:
         self.api_key = api_key or os.getenv("CODEBOX_API_KEY", "local")
         self.factory_id = factory_id or os.getenv("CODEBOX_FACTORY_ID", "default")
 
+    # CONTEXT MANAGER
+
+    def close(self) -> None:
+        """Release the resources held by this handle and stop its keep-alive"""
+        self._stop_keep_alive()
+
+    async def aclose(self) -> None:
+        """Async release the resources held by this handle and stop its keep-alive"""
+        self._stop_keep_alive()
+
+    def _stop_keep_alive(self) -> None:
+        """Cancel a running keep-alive from any thread, on the loop that owns it"""
+        if self._keep_alive is None:
+            return
+        scope, portal, thread_id = self._keep_alive
+        if thread_id == threading.get_ident():
+            scope.cancel()
+        else:
+            # cancel scopes are not thread safe, the owning loop has to cancel it
+            with suppress(RuntimeError):  # the keep-alive finished meanwhile
+                portal.call(scope.cancel)
+
+    def __enter__(self) -> "CodeBox":
+        return self
+
+    def __exit__(self, *_: t.Any) -> None:
+        self.close()
+
+    async def __aenter__(self) -> "CodeBox":
+        return self
+
+    async def __aexit__(self, *_: t.Any) -> None:
+        await self.aclose()
+
     # SYNC
 
     def exec(
@@ -97,7 +153,7 @@ class CodeBox:
     def upload(
         self,
         remote_file_path: str,
-        content: t.Union[t.BinaryIO, bytes, str],
+        content: t.Union[t.BinaryIO, bytes, str, t.Iterable[bytes]],
         timeout: t.Optional[float] = None,
     ) -> "RemoteFile":
         """Upload a file to the CodeBox instance"""
@@ -138,7 +194,7 @@ class CodeBox:
     async def aupload(
         self,
         remote_file_path: str,
-        content: t.Union[t.BinaryIO, bytes, str],
+        content: t.Union[t.BinaryIO, bytes, str, t.Iterable[bytes]],
         timeout: t.Optional[float] = None,
     ) -> "RemoteFile":
         """Async Upload a file to the CodeBox instance"""
@@ -149,7 +205,19 @@ class CodeBox:
         remote_file_path: str,
         timeout: t.Optional[float] = None,
     ) -> "RemoteFile":
-        return [f for f in (await self.alist_files()) if f.path in remote_file_path][0]
+        from .types import RemoteFile
+
+        # stat just this file instead of listing the whole workspace
+        size = (
+            await self.aexec(
+                f"stat -c %s {shlex.quote(remote_file_path)}",
+                kernel="bash",
+                timeout=timeout,
+            )
+        ).text.strip()
+        if not size.isdigit():
+            raise FileNotFoundError(remote_file_path)
+        return RemoteFile(path=remote_file_path, remote=self, _size=int(size))
 
     def astream_download(
         self,
@@ -161,17 +229,23 @@ class CodeBox:
 
     # HELPER METHODS
 
+    @single_flight
     async def ahealthcheck(self) -> t.Literal["healthy", "error"]:
-        return (
-            "healthy"
-            if "ok" in (await self.aexec("echo ok", kernel="bash")).text
-            else "error"
-        )
+        # a healthy answer is reused briefly and concurrent checks share one
+        # probe, so bursts of checks cost a single exec
+        if time.monotonic() - self._last_healthy < HEALTHY_TTL:
+            return "healthy"
+        if "ok" not in (await self.aexec("echo ok", kernel="bash")).text:
+            return "error"
+        self._last_healthy = time.monotonic()
+        return "healthy"
 
     async def ainstall(self, *packages: str) -> str:
         # todo make sure it always uses the correct python venv
+        # one resolver run for all packages, quoted so specifiers like
+        # "pandas>=2" are not read as shell redirects
         await self.aexec(
-            "uv pip install " + " ".join(packages),
+            "uv pip install " + " ".join(map(shlex.quote, packages)),
             kernel="bash",
         )
         return " ".join(packages) + " installed successfully"
@@ -194,35 +268,22 @@ class CodeBox:
         await self.aexec(code)
         return await self.adownload(file_path)
 
+    @single_flight
     async def alist_files(self) -> list["RemoteFile"]:
         from .types import RemoteFile
 
-        files = (
-            await self.aexec(
-                "find . -type f -exec du -h {} + | awk '{print $2, $1}' | sort",
-                kernel="bash",
-            )
-        ).text.splitlines()
-        return [
-            RemoteFile(
-                path=parts[0].removeprefix("./"),
-                remote=self,
-                _size=self._parse_size(parts[1]),
-            )
-            for file in files
-            if (parts := file.split(" ")) and len(parts) == 2
+        # one process that prints exact byte sizes and paths without "./"
+        listing = await self.aexec("find . -type f -printf '%s\\t%P\\n'", kernel="bash")
+        files = [
+            RemoteFile(path=path, remote=self, _size=int(size))
+            for line in listing.text.splitlines()
+            for size, _, path in (line.partition("\t"),)
+            if path
         ]
+        files.sort(key=attrgetter("path"))
+        return files
 
-    def _parse_size(self, size_str: str) -> int:
-        """Convert human-readable size to bytes."""
-        units = {"K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
-        try:
-            number = float(size_str[:-1])
-            unit = size_str[-1].upper()
-            return int(number * units.get(unit, 1))
-        except ValueError:
-            return -1
-
+    @single_flight
     async def alist_packages(self) -> list[str]:
         return (
             await self.aexec(
@@ -232,10 +293,12 @@ class CodeBox:
         ).text.splitlines()
 
     async def ashow_variables(self) -> dict[str, str]:
-        vars = [
-            line.strip() for line in (await self.aexec("%who")).text.strip().split()
-        ]
-        return {v: (await self.aexec(f"print({v}, end='')")).text for v in vars}
+        # a single exec dumps all variables as json, so any value text survives
+        dump = await self.aexec(
+            "print(__import__('json').dumps({n: str(globals()[n]) for n in "
+            "get_ipython().run_line_magic('who_ls', '')}), end='')"
+        )
+        return json.loads(dump.text or "{}")
 
     async def arestart(self) -> None:
         """Restart the Jupyter kernel"""
@@ -243,45 +306,53 @@ class CodeBox:
 
     async def akeep_alive(self, minutes: int = 15) -> None:
         """Keep the CodeBox instance alive for a certain amount of minutes"""
-
-        async def ping(cb: CodeBox, d: int) -> None:
-            for _ in range(d):
-                await cb.ahealthcheck()
-                await anyio.sleep(60)
-
-        async with anyio.create_task_group() as tg:
-            tg.start_soon(ping, self, minutes)
+        # every request keeps the session alive as well, so a ping is only
+        # sent once nothing else has reached the box for a whole interval
+        deadline = time.monotonic() + minutes * 60
+        try:
+            async with BlockingPortal() as portal:
+                with anyio.CancelScope() as scope:
+                    self._keep_alive = (scope, portal, threading.get_ident())
+                    while (remaining := deadline - time.monotonic()) > 0:
+                        idle = time.monotonic() - self._last_activity
+                        if idle >= KEEP_ALIVE_INTERVAL:
+                            # not the cached healthcheck, the ping has to reach it
+                            await self.aexec("echo ok", kernel="bash")
+                            idle = 0
+                        await anyio.sleep(min(KEEP_ALIVE_INTERVAL - idle, remaining))
+        finally:
+            self._keep_alive = None
 
     # SYNCIFY
 
     def download(
         self, remote_file_path: str, timeout: t.Optional[float] = None
     ) -> "RemoteFile":
-        return syncify(self.adownload)(remote_file_path, timeout)
+        return run_sync(self.adownload, remote_file_path, timeout)
 
     def healthcheck(self) -> str:
-        return syncify(self.ahealthcheck)()
+        return run_sync(self.ahealthcheck)
 
     def install(self, *packages: str) -> str:
-        return syncify(self.ainstall)(*packages)
+        return run_sync(self.ainstall, *packages)
 
     def file_from_url(self, url: str, file_path: str) -> "RemoteFile":
-        return syncify(self.afile_from_url)(url, file_path)
+        return run_sync(self.afile_from_url, url, file_path)
 
     def list_files(self) -> list["RemoteFile"]:
-        return syncify(self.alist_files)()
+        return run_sync(self.alist_files)
 
     def list_packages(self) -> list[str]:
-        return syncify(self.alist_packages)()
+        return run_sync(self.alist_packages)
 
     def show_variables(self) -> dict[str, str]:
-        return syncify(self.ashow_variables)()
+        return run_sync(self.ashow_variables)
 
     def restart(self) -> None:
-        return syncify(self.arestart)()
+        return run_sync(self.arestart)
 
     def keep_alive(self, minutes: int = 15) -> None:
-        return syncify(self.akeep_alive)(minutes)
+        return run_sync(self.akeep_alive, minutes)
 
     # DEPRECATED
 
@@ -324,7 +395,7 @@ class CodeBox:
         "The `.start` method is deprecated. Use `.healthcheck` instead.",
     )
     def start(self) -> t.Literal["started", "error"]:
-        return syncify(self.astart)()
+        return run_sync(self.astart)
 
     @deprecated(
         "The `.stop` method is deprecated. "
@@ -332,16 +403,16 @@ class CodeBox:
         "(default timeout: 15 minutes)"
     )
     def stop(self) -> t.Literal["stopped"]:
-        return syncify(self.astop)()
+        return run_sync(self.astop)
 
     @deprecated(
         "The `.run` method is deprecated. Use `.exec` instead.",
     )
     def run(self, code: t.Union[str, os.PathLike]) -> "CodeBoxOutput":
-        return syncify(self.arun)(code)
+        return run_sync(self.arun, code)
 
     @deprecated(
         "The `.status` method is deprecated. Use `.healthcheck` instead.",
     )
     def status(self) -> t.Literal["started", "running", "stopped"]:
-        return syncify(self.astatus)()
+        return run_sync(self.astatus)
@@ -1,11 +1,13 @@
 import socket
 import subprocess
-import time
 import typing as t
+from contextlib import suppress
 
+import anyio
 import httpx
+from tenacity import retry, retry_if_exception_type, wait_random_exponential
 
-from .remote import RemoteBox
+from .remote import RemoteBox, shared_client
 
 
 def get_free_port(port_or_range: t.Union[int, t.Tuple[int, int]]) -> int:
@@ -34,11 +36,18 @@ class DockerBox(RemoteBox):
         image: str = "shroominic/codebox:latest",
         timeout: float = 3,  # minutes
         start_container: bool = True,
+        client: t.Optional[httpx.Client] = None,
+        aclient: t.Optional[httpx.AsyncClient] = None,
         **_,
     ) -> None:
+        if getattr(self, "_initialized", False):
+            # the CodeBox factory already set this box up, nothing to redo
+            return
+        self._initialized = True
+        self.container_id: t.Optional[str] = None
         if start_container:
             self.port = get_free_port(port_or_range)
-            subprocess.run(
+            self.container_id = subprocess.run(
                 [
                     "docker",
                     "run",
@@ -51,25 +60,49 @@ class DockerBox(RemoteBox):
                     image,
                 ],
                 check=True,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL,
-            )
+                capture_output=True,
+                text=True,
+            ).stdout.strip()
         else:
             assert isinstance(port_or_range, int)
             self.port = port_or_range
         self.session_id = str(self.port)
         self.base_url = f"http://localhost:{self.port}"
-        self.client = httpx.Client(base_url=self.base_url)
-        self.aclient = httpx.AsyncClient(base_url=self.base_url)
+        self.url = self.base_url
+        self.headers = httpx.Headers()
+        self.json_headers = httpx.Headers({"Content-Type": "application/json"})
+        self.client = client or shared_client()
+        self._aclient = aclient
         self.api_key = "docker"
         self.factory_id = image
         self.session_id = str(self.port)
         self._wait_for_startup()
+        # leave a keep-alive connection in the pool for the first exec
+        with suppress(httpx.HTTPError):
+            self.client.get(self.url)
 
+    def close(self) -> None:
+        """Stop the keep-alive and the container if this handle started it"""
+        super().close()
+        if self.container_id:
+            subprocess.run(
+                ["docker", "stop", self.container_id],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+            self.container_id = None
+
+    async def aclose(self) -> None:
+        """Async stop the keep-alive and the container if this handle started it"""
+        await super().aclose()
+        if self.container_id:
+            await anyio.run_process(["docker", "stop", self.container_id], check=False)
+            self.container_id = None
+
+    @retry(
+        retry=retry_if_exception_type(httpx.HTTPError),
+        wait=wait_random_exponential(multiplier=0.05, max=1),
+    )
     def _wait_for_startup(self) -> None:
-        while True:
-            try:
-                self.client.get("/")
-                break
-            except httpx.HTTPError:
-                time.sleep(1)
+        # short jittered delays first, the container is often up in under a second
+        httpx.get(self.url)
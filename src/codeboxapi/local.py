@@ -10,6 +10,10 @@ import base64
 import io
 import os
 import re
+import selectors
+import shutil
+import signal
+import stat
 import subprocess
 import sys
 import tempfile as tmpf
@@ -17,9 +21,13 @@ import threading
 import time
 import typing as t
 from builtins import print as important_print
-from queue import Queue
+from contextlib import suppress
+from functools import cached_property
+from importlib.metadata import PackageNotFoundError
+from warnings import warn
 
 from IPython.core.interactiveshell import ExecutionResult, InteractiveShell
+from traitlets.config import Config
 
 from .codebox import CodeBox
 from .types import ExecChunk, RemoteFile
@@ -29,9 +37,114 @@ from .utils import (
     raise_timeout,
     resolve_pathlike,
     run_inside,
+    single_flight,
 )
 
-IMAGE_PATTERN = r"<image>(.*?)</image>"
+IMAGE_PATTERN = re.compile(r"<image>(.*?)</image>")
+OUT_PATTERN = re.compile(r"Out\[(.*?)\]: ")
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+INLINE_WRITE_SIZE = 64 * 1024
+PACKAGE_NAME = re.compile(r"[A-Za-z0-9][A-Za-z0-9._-]*")
+BASH_READ_SIZE = 64 * 1024
+
+
+def _output_chunks(output: str) -> t.Iterator[ExecChunk]:
+    """Split captured stdout into image and text chunks"""
+    if "<image>" in output:
+        for img_str in IMAGE_PATTERN.findall(output):
+            yield ExecChunk(type="img", content=img_str)
+        output = IMAGE_PATTERN.sub("", output)
+
+    if output:
+        if output.startswith("Out["):
+            # todo better disable logging somehow
+            output = OUT_PATTERN.sub("", output.strip())
+        yield ExecChunk(type="txt", content=output)
+
+
+def _is_installed(package: str) -> bool:
+    """Only plain names are looked up, version specifiers always go to uv"""
+    if not PACKAGE_NAME.fullmatch(package):
+        return False
+    try:
+        check_installed(package)
+    except PackageNotFoundError:
+        return False
+    return True
+
+
+def _sendfile(src: t.Any, dst: t.BinaryIO) -> bool:
+    """Copy the rest of a regular file inside the kernel, False if not applicable"""
+    # plain files only, fileno() would roll a SpooledTemporaryFile over to disk
+    if not hasattr(os, "sendfile") or not isinstance(
+        src, (io.BufferedReader, io.FileIO)
+    ):
+        return False
+    try:
+        src_fd, dst_fd = src.fileno(), dst.fileno()
+        info = os.fstat(src_fd)
+    except (OSError, io.UnsupportedOperation):
+        return False
+    if not stat.S_ISREG(info.st_mode):
+        return False
+    dst.flush()
+    start = offset = src.tell()
+    try:
+        while offset < info.st_size and (
+            sent := os.sendfile(dst_fd, src_fd, offset, info.st_size - offset)
+        ):
+            offset += sent
+    except OSError:
+        if offset != start:
+            raise
+        return False
+    src.seek(offset)
+    return True
+
+
+def _pipe_chunks(process: subprocess.Popen) -> t.Iterator[ExecChunk]:
+    """Stream the stdout and stderr lines of a process as they arrive"""
+    assert process.stdout and process.stderr
+    if os.name != "posix":
+        # select() on windows only accepts sockets, so the pipes are read in turn
+        for line in process.stdout:
+            yield ExecChunk(type="txt", content=line.decode())
+        for line in process.stderr:
+            yield ExecChunk(type="err", content=line.decode())
+        return
+
+    types: dict[int, t.Literal["txt", "err"]] = {
+        process.stdout.fileno(): "txt",
+        process.stderr.fileno(): "err",
+    }
+    buffers = dict.fromkeys(types, b"")
+    # read both pipes as data arrives, in large raw reads split
+    # into lines here instead of decoding line by line
+    with selectors.DefaultSelector() as selector:
+        for fd in types:
+            selector.register(fd, selectors.EVENT_READ)
+        while selector.get_map():
+            for key, _ in selector.select():
+                fd = t.cast(int, key.fd)
+                if data := os.read(fd, BASH_READ_SIZE):
+                    *lines, buffers[fd] = (buffers[fd] + data).split(b"\n")
+                    for line in lines:
+                        yield ExecChunk(type=types[fd], content=line.decode() + "\n")
+                    continue
+                selector.unregister(fd)
+                if buffers[fd]:
+                    yield ExecChunk(type=types[fd], content=buffers[fd].decode())
+
+
+def _kill_shell(process: t.Union[subprocess.Popen, asyncio.subprocess.Process]) -> None:
+    """Kill a shell process together with the commands it started"""
+    if os.name != "posix":
+        process.kill()
+        return
+    # the shell runs in its own session, so its process group holds the
+    # commands it started, which would otherwise keep the pipes open
+    with suppress(ProcessLookupError):
+        os.killpg(process.pid, signal.SIGKILL)
 
 
 class LocalBox(CodeBox):
@@ -63,18 +176,39 @@ class LocalBox(CodeBox):
     def __init__(
         self,
         session_id: t.Optional[str] = None,
-        codebox_cwd: str = ".codebox",
+        codebox_cwd: t.Optional[str] = None,
         **kwargs,
     ) -> None:
+        if getattr(self, "_initialized", False):
+            # the factory hands out the cached instance, nothing to redo
+            if codebox_cwd and os.path.abspath(codebox_cwd) != self.cwd:
+                warn(
+                    f"LocalBox already runs in {self.cwd}, "
+                    f"codebox_cwd={codebox_cwd!r} is ignored",
+                    stacklevel=2,
+                )
+            return
+        self._initialized = True
         self.api_key = "local"
         self.factory_id = "local"
         self.session_id = session_id or ""
+        codebox_cwd = codebox_cwd or ".codebox"
         os.makedirs(codebox_cwd, exist_ok=True)
-        self.cwd = os.path.abspath(codebox_cwd)
+        self.cwd: str = os.path.abspath(codebox_cwd)
         check_installed("ipython")
-        self.shell = InteractiveShell.instance()
-        self.shell.enable_gui = lambda x: None  # type: ignore
+
+    @cached_property
+    def shell(self) -> InteractiveShell:
+        # started on first exec, so file operations and bash commands
+        # do not pay for the IPython shell and the matplotlib import;
+        # the sqlite history is disabled because it is bound to the thread
+        # that creates the shell, which may be a worker thread
+        config = Config()
+        config.HistoryManager.enabled = False
+        shell = InteractiveShell.instance(config=config)
+        shell.enable_gui = lambda x: None  # type: ignore
         self._patch_matplotlib_show()
+        return shell
 
     def _patch_matplotlib_show(self) -> None:
         import matplotlib
@@ -88,7 +222,7 @@ class LocalBox(CodeBox):
             fig.savefig(buf, format="png")
             buf.seek(0)
             img_str = base64.b64encode(buf.getvalue()).decode("utf-8")
-            important_print(IMAGE_PATTERN.replace("(.*?)", img_str))
+            important_print(f"<image>{img_str}</image>")
             if close:
                 plt.close(fig)
 
@@ -111,62 +245,32 @@ class LocalBox(CodeBox):
                         io.StringIO(),
                         io.StringIO(),
                     )
-                    queue: Queue[t.Optional[ExecChunk]] = Queue()
                     _result: list[ExecutionResult] = []
 
+                    shell = self.shell
+
                     def _run_cell(c: str, result: list[ExecutionResult]) -> None:
                         time.sleep(0.001)
-                        result.append(self.shell.run_cell(c))
+                        result.append(shell.run_cell(c))
 
                     run_cell = threading.Thread(target=_run_cell, args=(code, _result))
                     try:
-
-                        def stream_chunks(_out: io.StringIO, _err: io.StringIO) -> None:
-                            while run_cell.is_alive():
-                                time.sleep(0.001)
-                                if output := _out.getvalue():
-                                    # todo make this more efficient?
-                                    sys.stdout = _out = io.StringIO()
-
-                                    if "<image>" in output:
-                                        image_matches = re.findall(
-                                            IMAGE_PATTERN, output
-                                        )
-                                        for img_str in image_matches:
-                                            queue.put(
-                                                ExecChunk(type="img", content=img_str)
-                                            )
-                                        output = re.sub(IMAGE_PATTERN, "", output)
-
-                                    if output:
-                                        if output.startswith("Out["):
-                                            # todo better disable logging somehow
-                                            output = re.sub(
-                                                r"Out\[(.*?)\]: ", "", output.strip()
-                                            )
-                                        queue.put(ExecChunk(type="txt", content=output))
-
-                                if error := _err.getvalue():
-                                    # todo make this more efficient?
-                                    sys.stderr = _err = io.StringIO()
-                                    queue.put(ExecChunk(type="err", content=error))
-
-                            queue.put(None)
-
-                        stream = threading.Thread(
-                            target=stream_chunks, args=(temp_output, temp_error)
-                        )
-
                         run_cell.start()
-                        stream.start()
-
+                        # poll the captured output from this generator directly,
+                        # one last time after the cell finished to drain it
                         while True:
-                            time.sleep(0.001)
-                            if queue.qsize() > 0:
-                                if chunk := queue.get():
-                                    yield chunk
-                                else:
-                                    break
+                            done = not run_cell.is_alive()
+                            if output := temp_output.getvalue():
+                                sys.stdout = temp_output = io.StringIO()
+                                yield from _output_chunks(output)
+
+                            if error := temp_error.getvalue():
+                                sys.stderr = temp_error = io.StringIO()
+                                yield ExecChunk(type="err", content=error)
+
+                            if done:
+                                break
+                            run_cell.join(0.001)
 
                         result = _result[0]
                         if result.error_before_exec:
@@ -190,20 +294,23 @@ class LocalBox(CodeBox):
                         run_cell._stop()  # type: ignore
 
             elif kernel == "bash":
-                # todo maybe implement using queue
                 process = subprocess.Popen(
                     code,
                     cwd=cwd or self.cwd,
                     shell=True,
                     stdout=subprocess.PIPE,
                     stderr=subprocess.PIPE,
+                    start_new_session=True,
                 )
-                if process.stdout:
-                    for c in process.stdout:
-                        yield ExecChunk(content=c.decode(), type="txt")
-                if process.stderr:
-                    for c in process.stderr:
-                        yield ExecChunk(content=c.decode(), type="err")
+                assert process.stdout and process.stderr
+                try:
+                    yield from _pipe_chunks(process)
+                    process.wait()
+                finally:
+                    if process.poll() is None:
+                        _kill_shell(process)
+                    process.stdout.close()
+                    process.stderr.close()
 
             else:
                 raise ValueError(f"Unsupported kernel: {kernel}")
@@ -230,30 +337,23 @@ class LocalBox(CodeBox):
                         asyncio.to_thread(self.shell.run_cell, code)
                     )
                     try:
-                        while not run_cell.done():
-                            await asyncio.sleep(0.001)
+                        # drain once more after the cell finished, the wait
+                        # returns early as soon as the cell is done
+                        while True:
+                            done = run_cell.done()
                             if output := temp_output.getvalue():
-                                # todo make this more efficient?
                                 sys.stdout = temp_output = io.StringIO()
-
-                                if "<image>" in output:
-                                    image_matches = re.findall(IMAGE_PATTERN, output)
-                                    for img_str in image_matches:
-                                        yield ExecChunk(type="img", content=img_str)
-                                    output = re.sub(IMAGE_PATTERN, "", output)
-
-                                if output:
-                                    if output.startswith("Out["):
-                                        # todo better disable logging somehow
-                                        output = re.sub(
-                                            r"Out\[(.*?)\]: ", "", output.strip()
-                                        )
-                                    yield ExecChunk(type="txt", content=output)
+                                for chunk in _output_chunks(output):
+                                    yield chunk
 
                             if error := temp_error.getvalue():
                                 sys.stderr = temp_error = io.StringIO()
                                 yield ExecChunk(type="err", content=error)
 
+                            if done:
+                                break
+                            await asyncio.wait((run_cell,), timeout=0.001)
+
                         result = await run_cell
                         if result.error_before_exec:
                             yield ExecChunk(
@@ -276,23 +376,54 @@ class LocalBox(CodeBox):
                     cwd=cwd or self.cwd,
                     stdout=asyncio.subprocess.PIPE,
                     stderr=asyncio.subprocess.PIPE,
+                    start_new_session=True,
                 )
 
-                # todo yield at the same time and not after each other
-                if process.stdout:
-                    async for chunk in process.stdout:
-                        yield ExecChunk(content=chunk.decode(), type="txt")
-
-                if process.stderr:
-                    async for err in process.stderr:
-                        yield ExecChunk(content=err.decode(), type="err")
+                assert process.stdout and process.stderr
+                chunks: asyncio.Queue[t.Optional[ExecChunk]] = asyncio.Queue()
+
+                async def forward(
+                    stream: asyncio.StreamReader, type: t.Literal["txt", "err"]
+                ) -> None:
+                    # read whatever is available and split it into lines here,
+                    # a partial line waits in the buffer for the next read
+                    buffer = b""
+                    while data := await stream.read(BASH_READ_SIZE):
+                        *lines, buffer = (buffer + data).split(b"\n")
+                        for line in lines:
+                            content = line.decode() + "\n"
+                            await chunks.put(ExecChunk(type=type, content=content))
+                    if buffer:
+                        await chunks.put(ExecChunk(type=type, content=buffer.decode()))
+                    await chunks.put(None)
+
+                # drain both pipes at the same time so a full stderr pipe
+                # can not block the process while stdout is being read
+                readers = [
+                    asyncio.create_task(forward(process.stdout, "txt")),
+                    asyncio.create_task(forward(process.stderr, "err")),
+                ]
+                try:
+                    open_pipes = len(readers)
+                    while open_pipes:
+                        if item := await chunks.get():
+                            yield item
+                        else:
+                            open_pipes -= 1
+                    await process.wait()
+                finally:
+                    for reader in readers:
+                        reader.cancel()
+                    if process.returncode is None:
+                        _kill_shell(process)
+                        await process.wait()
             else:
                 raise ValueError(f"Unsupported kernel: {kernel}")
 
     def upload(
         self,
         remote_file_path: str,
-        content: t.Union[t.BinaryIO, bytes, str],
+        content: t.Union[t.BinaryIO, bytes, str, t.Iterable[bytes]],
         timeout: t.Optional[float] = None,
     ) -> "RemoteFile":
         from .types import RemoteFile
@@ -304,10 +435,16 @@ class LocalBox(CodeBox):
                     file.write(content.encode())
                 elif isinstance(content, bytes):
                     file.write(content)
-                elif isinstance(content, tmpf.SpooledTemporaryFile):
-                    file.write(content.read())
-                elif isinstance(content, (t.BinaryIO, io.BytesIO)):
-                    file.write(content.read())
+                elif isinstance(
+                    content, (t.BinaryIO, io.IOBase, tmpf.SpooledTemporaryFile)
+                ):
+                    # regular files are copied by the kernel, anything else through
+                    # a bounded buffer instead of reading it into memory at once
+                    if not _sendfile(content, file):
+                        shutil.copyfileobj(content, file, UPLOAD_CHUNK_SIZE)
+                elif isinstance(content, t.Iterable):
+                    for chunk in content:
+                        file.write(chunk)
                 else:
                     raise TypeError("Unsupported content type")
             return RemoteFile(path=remote_file_path, remote=self)
@@ -315,7 +452,9 @@ class LocalBox(CodeBox):
     async def aupload(
         self,
         file_name: str,
-        content: t.Union[t.BinaryIO, bytes, str, tmpf.SpooledTemporaryFile],
+        content: t.Union[
+            t.BinaryIO, bytes, str, t.Iterable[bytes], tmpf.SpooledTemporaryFile
+        ],
         timeout: t.Optional[float] = None,
     ) -> RemoteFile:
         import aiofiles.os
@@ -324,14 +463,21 @@ class LocalBox(CodeBox):
 
         async with async_raise_timeout(timeout):
             file_path = os.path.join(self.cwd, file_name)
+            if isinstance(content, str):
+                content = content.encode()
+            if isinstance(content, bytes) and len(content) < INLINE_WRITE_SIZE:
+                # a small write costs less than the hop to the aiofiles thread
+                with open(file_path, "wb") as f:
+                    f.write(content)
+                return RemoteFile(path=file_path, remote=self)
+
             async with aiofiles.open(file_path, "wb") as file:
-                if isinstance(content, str):
-                    await file.write(content.encode())
-                elif isinstance(content, tmpf.SpooledTemporaryFile):
-                    await file.write(content.read())
-                elif isinstance(content, (t.BinaryIO, io.BytesIO)):
+                if isinstance(
+                    content, (t.BinaryIO, io.IOBase, tmpf.SpooledTemporaryFile)
+                ):
+                    # large chunks, every write is a hop to the aiofiles thread
                     try:
-                        while chunk := content.read(8192):
+                        while chunk := content.read(UPLOAD_CHUNK_SIZE):
                             await file.write(chunk)
                     except ValueError as e:
                         if "I/O operation on closed file" in str(e):
@@ -344,6 +490,9 @@ class LocalBox(CodeBox):
                             raise
                 elif isinstance(content, bytes):
                     await file.write(content)
+                elif isinstance(content, t.Iterable):
+                    for chunk in content:
+                        await file.write(chunk)
                 else:
                     print(type(content), content.__dict__)
                     raise TypeError("Unsupported content type")
@@ -372,3 +521,52 @@ class LocalBox(CodeBox):
             ) as f:
                 while chunk := await f.read(8192):
                     yield chunk
+
+    async def adownload(
+        self,
+        remote_file_path: str,
+        timeout: t.Optional[float] = None,
+    ) -> RemoteFile:
+        try:
+            size = os.stat(os.path.join(self.cwd, remote_file_path)).st_size
+        except OSError:
+            raise FileNotFoundError(remote_file_path) from None
+        return RemoteFile(path=remote_file_path, remote=self, _size=size)
+
+    async def ainstall(self, *packages: str) -> str:
+        # the shell runs in this interpreter, so packages that are already
+        # installed here can skip the uv resolver round trip
+        if missing := [p for p in packages if not _is_installed(p)]:
+            await super().ainstall(*missing)
+        return " ".join(packages) + " installed successfully"
+
+    def list_files(self) -> list[RemoteFile]:
+        # scandir reports file type and size without a bash round trip
+        files: list[RemoteFile] = []
+        dirs = [""]
+        while dirs:
+            prefix = dirs.pop()
+            with os.scandir(os.path.join(self.cwd, prefix)) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(f"{prefix}{entry.name}/")
+                    elif entry.is_file(follow_symlinks=False):
+                        files.append(
+                            RemoteFile(
+                                path=prefix + entry.name,
+                                remote=self,
+                                _size=entry.stat(follow_symlinks=False).st_size,
+                            )
+                        )
+        return sorted(files, key=lambda f: f.path)
+
+    @single_flight
+    async def alist_files(self) -> list[RemoteFile]:
+        if not os.path.isdir(self.cwd):
+            return []
+        return await asyncio.to_thread(self.list_files)
+
+
+def get_local_box(*args: t.Any, **kwargs: t.Any) -> LocalBox:
+    """Returns the process wide LocalBox, creating it on first use"""
+    return LocalBox._instance or LocalBox(*args, **kwargs)
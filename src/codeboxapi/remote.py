@@ -1,10 +1,15 @@
+import atexit
 import re
+import time
 import typing as t
+from functools import partial
 from os import PathLike, getenv
 from uuid import uuid4
+from weakref import WeakSet
 
 import anyio
 import httpx
+from anyio.lowlevel import RunVar
 from tenacity import (
     retry,
     retry_if_exception,
@@ -14,7 +19,101 @@ from tenacity import (
 
 from .codebox import CodeBox
 from .types import ExecChunk, RemoteFile
-from .utils import raise_error, resolve_pathlike
+from .utils import (
+    close_after_sync_run,
+    iter_as_file,
+    json_dumps,
+    raise_error,
+    resolve_pathlike,
+)
+
+CHUNK_PATTERN = re.compile(r"<(txt|img|err)>(.*?)</\1>", re.DOTALL)
+RETRY_STATUS_CODES = frozenset({502, 503})
+# a 504 can arrive after the upstream already ran the request, so it is only
+# retried for requests that are safe to send twice
+SAFE_RETRY_STATUS_CODES = RETRY_STATUS_CODES | {504}
+SAFE_METHODS = frozenset({"GET", "HEAD"})
+
+
+def _is_retryable(e: BaseException) -> bool:
+    if not isinstance(e, httpx.HTTPStatusError):
+        return False
+    if e.request.method in SAFE_METHODS:
+        return e.response.status_code in SAFE_RETRY_STATUS_CODES
+    return e.response.status_code in RETRY_STATUS_CODES
+
+
+retry_on_gateway_error = retry(
+    retry=retry_if_exception(_is_retryable),
+    wait=wait_exponential(multiplier=1, min=5, max=150),
+    stop=stop_after_attempt(3),
+    reraise=True,
+)
+
+# httpx drops idle connections after 5s by default, too short for sessions
+# that are used in bursts, so idle connections are kept around for longer
+POOL_LIMITS = httpx.Limits(
+    max_connections=int(getenv("CODEBOX_POOL_LIMIT", "64")),
+    max_keepalive_connections=int(getenv("CODEBOX_POOL_LIMIT", "64")),
+    keepalive_expiry=float(getenv("CODEBOX_KEEPALIVE", "30")),
+)
+
+_shared_client: t.Optional[httpx.Client] = None
+_shared_aclient: RunVar[httpx.AsyncClient] = RunVar("codebox_shared_aclient")
+_shared_aclient_users: RunVar["WeakSet[RemoteBox]"] = RunVar(
+    "codebox_shared_aclient_users"
+)
+
+
+def shared_client() -> httpx.Client:
+    """Process wide client, so all sessions reuse one keep-alive connection pool"""
+    global _shared_client
+    if _shared_client is None or _shared_client.is_closed:
+        # limits instead of a custom transport, so proxies from the
+        # environment (HTTPS_PROXY, ...) are still mounted by httpx
+        _shared_client = httpx.Client(limits=POOL_LIMITS)
+        atexit.register(_shared_client.close)
+    return _shared_client
+
+
+def shared_aclient(user: t.Optional["RemoteBox"] = None) -> httpx.AsyncClient:
+    """
+    Async client shared by all sessions on the current event loop.
+    Async connections are bound to the loop that opened them. Sync helpers run
+    their own loop per call, so their client is closed again when it finishes.
+    On any other loop it is closed once the last session using it is closed.
+    """
+    if (aclient := _shared_aclient.get(None)) is None or aclient.is_closed:
+        aclient = httpx.AsyncClient(limits=POOL_LIMITS)
+        _shared_aclient.set(aclient)
+        if not close_after_sync_run(aclient.aclose):
+            _shared_aclient_users.set(WeakSet())
+    if user is not None and (users := _shared_aclient_users.get(None)) is not None:
+        users.add(user)
+    return aclient
+
+
+async def release_shared_aclient(user: "RemoteBox") -> None:
+    """Close the async client of the current loop if no other session uses it"""
+    if (users := _shared_aclient_users.get(None)) is None or user not in users:
+        return
+    users.discard(user)
+    if not users:
+        await _shared_aclient.get().aclose()
+
+
+def _upload_rewinder(
+    content: t.Union[t.BinaryIO, bytes],
+) -> t.Optional[t.Callable[[], t.Any]]:
+    """Reset the upload content for another attempt, None if it can't be replayed"""
+    if isinstance(content, bytes):
+        return lambda: None
+    try:
+        if content.seekable():
+            return partial(content.seek, content.tell())
+    except (AttributeError, OSError, ValueError):
+        pass
+    return None
 
 
 class RemoteBox(CodeBox):
@@ -22,6 +121,8 @@ class RemoteBox(CodeBox):
     Sandboxed Python Interpreter
     """
 
+    _head_unsupported = False
+
     def __new__(cls, *args, **kwargs) -> "RemoteBox":
         # This is a hack to ignore the CodeBox.__new__ factory method.
         return object.__new__(cls)
@@ -32,6 +133,8 @@ class RemoteBox(CodeBox):
         api_key: t.Optional[t.Union[str, t.Literal["local", "docker"]]] = None,
         factory_id: t.Optional[t.Union[str, t.Literal["default"]]] = None,
         base_url: t.Optional[str] = None,
+        client: t.Optional[httpx.Client] = None,
+        aclient: t.Optional[httpx.AsyncClient] = None,
     ) -> None:
         self.session_id = session_id or uuid4().hex
         self.factory_id = factory_id or getenv("CODEBOX_FACTORY_ID", "default")
@@ -45,21 +148,53 @@ class RemoteBox(CodeBox):
             "CODEBOX_BASE_URL", "https://codeboxapi.com/api/v2"
         )
         self.url = f"{self.base_url}/codebox/{self.session_id}"
-        self.headers = {
+        # encoded once here instead of on every request
+        self.headers = httpx.Headers({
             "Factory-Id": self.factory_id,
             "Authorization": f"Bearer {self.api_key}",
-        }
-        self.client = httpx.Client(base_url=self.url, headers=self.headers)
-        self.aclient = httpx.AsyncClient(base_url=self.url, headers=self.headers)
-
-    @retry(
-        retry=retry_if_exception(
-            lambda e: isinstance(e, httpx.HTTPStatusError)
-            and e.response.status_code == 502
-        ),
-        wait=wait_exponential(multiplier=1, min=5, max=150),
-        stop=stop_after_attempt(3),
-    )
+        })
+        self.json_headers = self.headers.copy()
+        self.json_headers["Content-Type"] = "application/json"
+        # clients are shared across sessions, so requests use absolute urls
+        self.client = client or shared_client()
+        self._aclient = aclient
+
+    @property
+    def aclient(self) -> httpx.AsyncClient:
+        return self._aclient or shared_aclient(self)
+
+    async def aclose(self) -> None:
+        """Async stop the keep-alive and release the shared client of this loop"""
+        await super().aclose()
+        if self._aclient is None:
+            await release_shared_aclient(self)
+
+    @retry_on_gateway_error
+    def _open_stream(self, method: str, url: str, **kwargs: t.Any) -> httpx.Response:
+        """Send the request and return the streamed response once it is accepted"""
+        # retried here, a retry around the generators would only cover
+        # creating them, not the request they send when iterated
+        self._last_activity = time.monotonic()
+        request = self.client.build_request(method, url, **kwargs)
+        response = self.client.send(request, stream=True)
+        if response.is_error:
+            response.close()
+        response.raise_for_status()
+        return response
+
+    @retry_on_gateway_error
+    async def _aopen_stream(
+        self, method: str, url: str, **kwargs: t.Any
+    ) -> httpx.Response:
+        """Async send the request and return the streamed response once accepted"""
+        self._last_activity = time.monotonic()
+        request = self.aclient.build_request(method, url, **kwargs)
+        response = await self.aclient.send(request, stream=True)
+        if response.is_error:
+            await response.aclose()
+        response.raise_for_status()
+        return response
+
     def stream_exec(
         self,
         code: t.Union[str, PathLike],
@@ -68,32 +203,26 @@ class RemoteBox(CodeBox):
         cwd: t.Optional[str] = None,
     ) -> t.Generator[ExecChunk, None, None]:
         code = resolve_pathlike(code)
-        with self.client.stream(
+        response = self._open_stream(
             method="POST",
-            url="/exec",
+            url=f"{self.url}/exec",
+            headers=self.json_headers,
             timeout=timeout,
-            json={"code": code, "kernel": kernel, "cwd": cwd},
-        ) as response:
-            response.raise_for_status()
+            content=json_dumps({"code": code, "kernel": kernel, "cwd": cwd}),
+        )
+        try:
             buffer = ""
             for chunk in response.iter_text():
                 buffer += chunk
-                while match := re.match(
-                    r"<(txt|img|err)>(.*?)</\1>", buffer, re.DOTALL
-                ):
-                    _, end = match.span()
+                end = 0
+                while match := CHUNK_PATTERN.match(buffer, end):
+                    end = match.end()
                     t, c = match.groups()
                     yield ExecChunk(type=t, content=c)  # type: ignore[arg-type]
-                    buffer = buffer[end:]
+                buffer = buffer[end:]
+        finally:
+            response.close()
 
-    @retry(
-        retry=retry_if_exception(
-            lambda e: isinstance(e, httpx.HTTPStatusError)
-            and e.response.status_code == 502
-        ),
-        wait=wait_exponential(multiplier=1, min=5, max=150),
-        stop=stop_after_attempt(3),
-    )
     async def astream_exec(
         self,
         code: t.Union[str, PathLike],
@@ -103,23 +232,25 @@ class RemoteBox(CodeBox):
     ) -> t.AsyncGenerator[ExecChunk, None]:
         code = resolve_pathlike(code)
         try:
-            async with self.aclient.stream(
+            response = await self._aopen_stream(
                 method="POST",
-                url="/exec",
+                url=f"{self.url}/exec",
+                headers=self.json_headers,
                 timeout=timeout,
-                json={"code": code, "kernel": kernel, "cwd": cwd},
-            ) as response:
-                response.raise_for_status()
+                content=json_dumps({"code": code, "kernel": kernel, "cwd": cwd}),
+            )
+            try:
                 buffer = ""
                 async for chunk in response.aiter_text():
                     buffer += chunk
-                    while match := re.match(
-                        r"<(txt|img|err)>(.*?)</\1>", buffer, re.DOTALL
-                    ):
-                        _, end = match.span()
+                    end = 0
+                    while match := CHUNK_PATTERN.match(buffer, end):
+                        end = match.end()
                         t, c = match.groups()
                         yield ExecChunk(type=t, content=c)  # type: ignore[arg-type]
-                        buffer = buffer[end:]
+                    buffer = buffer[end:]
+            finally:
+                await response.aclose()
         except RuntimeError as e:
             if "loop is closed" not in str(e):
                 raise e
@@ -127,97 +258,125 @@ class RemoteBox(CodeBox):
             async for c in self.astream_exec(code, kernel, timeout, cwd):
                 yield c
 
-    @retry(
-        retry=retry_if_exception(
-            lambda e: isinstance(e, httpx.HTTPStatusError)
-            and e.response.status_code == 502
-        ),
-        wait=wait_exponential(multiplier=1, min=5, max=150),
-        stop=stop_after_attempt(3),
-    )
     def upload(
         self,
         file_name: str,
-        content: t.Union[t.BinaryIO, bytes, str],
+        content: t.Union[t.BinaryIO, bytes, str, t.Iterable[bytes]],
         timeout: t.Optional[float] = None,
     ) -> "RemoteFile":
         from .types import RemoteFile
 
-        if isinstance(content, str):
-            content = content.encode("utf-8")
-        self.client.post(
-            url="/files/upload",
-            files={"file": (file_name, content)},
-            timeout=timeout,
-        ).raise_for_status()
+        files = self._upload_files(file_name, content)
+        rewind = _upload_rewinder(files["file"][1])
+
+        def post() -> None:
+            if rewind:
+                rewind()
+            self._last_activity = time.monotonic()
+            self.client.post(
+                url=f"{self.url}/files/upload",
+                headers=self.headers,
+                files=files,
+                timeout=timeout,
+            ).raise_for_status()
+
+        # streamed content can only be sent once, so it is not retried
+        (retry_on_gateway_error(post) if rewind else post)()
         return RemoteFile(path=file_name, remote=self)
 
-    @retry(
-        retry=retry_if_exception(
-            lambda e: isinstance(e, httpx.HTTPStatusError)
-            and e.response.status_code == 502
-        ),
-        wait=wait_exponential(multiplier=1, min=5, max=150),
-        stop=stop_after_attempt(3),
-    )
     async def aupload(
         self,
         remote_file_path: str,
-        content: t.Union[t.BinaryIO, bytes, str],
+        content: t.Union[t.BinaryIO, bytes, str, t.Iterable[bytes]],
         timeout: t.Optional[float] = None,
     ) -> "RemoteFile":
         from .types import RemoteFile
 
+        files = self._upload_files(remote_file_path, content)
+        rewind = _upload_rewinder(files["file"][1])
+
+        async def post() -> None:
+            if rewind:
+                rewind()
+            self._last_activity = time.monotonic()
+            response = await self.aclient.post(
+                url=f"{self.url}/files/upload",
+                headers=self.headers,
+                files=files,
+                timeout=timeout,
+            )
+            response.raise_for_status()
+
+        # streamed content can only be sent once, so it is not retried
+        await (retry_on_gateway_error(post) if rewind else post)()
+        return RemoteFile(path=remote_file_path, remote=self)
+
+    def _upload_files(
+        self,
+        file_name: str,
+        content: t.Union[t.BinaryIO, bytes, str, t.Iterable[bytes]],
+    ) -> dict[str, tuple[str, t.Union[t.BinaryIO, bytes]]]:
+        """Build the multipart payload, file objects are streamed as they are."""
         if isinstance(content, str):
-            content = content.encode("utf-8")
-        response = await self.aclient.post(
-            url="/files/upload",
-            files={"file": (remote_file_path, content)},
+            return {"file": (file_name, content.encode("utf-8"))}
+        if isinstance(content, bytes) or hasattr(content, "read"):
+            return {"file": (file_name, t.cast(t.Union[t.BinaryIO, bytes], content))}
+        return {"file": (file_name, iter_as_file(content))}
+
+    async def adownload(
+        self,
+        remote_file_path: str,
+        timeout: t.Optional[float] = None,
+    ) -> "RemoteFile":
+        if self._head_unsupported:
+            return await super().adownload(remote_file_path, timeout)
+        # the headers of the download route carry the size, no exec needed
+        self._last_activity = time.monotonic()
+        response = await self.aclient.head(
+            url=f"{self.url}/files/download/{remote_file_path}",
+            headers=self.headers,
             timeout=timeout,
         )
-        response.raise_for_status()
-        return RemoteFile(path=remote_file_path, remote=self)
+        if response.status_code == 404:
+            raise FileNotFoundError(remote_file_path)
+        if response.status_code == 405:
+            # older servers only route GET, so later downloads skip the HEAD
+            self._head_unsupported = True
+        elif response.is_success and "Content-Length" in response.headers:
+            size = int(response.headers["Content-Length"])
+            return RemoteFile(path=remote_file_path, remote=self, _size=size)
+        return await super().adownload(remote_file_path, timeout)
 
-    @retry(
-        retry=retry_if_exception(
-            lambda e: isinstance(e, httpx.HTTPStatusError)
-            and e.response.status_code == 502
-        ),
-        wait=wait_exponential(multiplier=1, min=5, max=150),
-        stop=stop_after_attempt(3),
-    )
     def stream_download(
         self,
         remote_file_path: str,
         timeout: t.Optional[float] = None,
     ) -> t.Generator[bytes, None, None]:
-        with self.client.stream(
+        response = self._open_stream(
             method="GET",
-            url=f"/files/download/{remote_file_path}",
+            url=f"{self.url}/files/download/{remote_file_path}",
+            headers=self.headers,
             timeout=timeout,
-        ) as response:
-            response.raise_for_status()
+        )
+        try:
             for chunk in response.iter_bytes():
                 yield chunk
+        finally:
+            response.close()
 
-    @retry(
-        retry=retry_if_exception(
-            lambda e: isinstance(e, httpx.HTTPStatusError)
-            and e.response.status_code == 502
-        ),
-        wait=wait_exponential(multiplier=1, min=5, max=150),
-        stop=stop_after_attempt(3),
-    )
     async def astream_download(
         self,
         remote_file_path: str,
         timeout: t.Optional[float] = None,
     ) -> t.AsyncGenerator[bytes, None]:
-        async with self.aclient.stream(
+        response = await self._aopen_stream(
             method="GET",
-            url=f"/files/download/{remote_file_path}",
+            url=f"{self.url}/files/download/{remote_file_path}",
+            headers=self.headers,
             timeout=timeout,
-        ) as response:
-            response.raise_for_status()
+        )
+        try:
             async for chunk in response.aiter_bytes():
                 yield chunk
+        finally:
+            await response.aclose()
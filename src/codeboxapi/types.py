@@ -22,9 +22,9 @@ class RemoteFile:
 
     async def aget_content(self) -> bytes:
         if self._content is None:
-            self._content = b""
-            async for chunk in self.remote.astream_download(self.path):
-                self._content += chunk
+            self._content = b"".join([
+                chunk async for chunk in self.remote.astream_download(self.path)
+            ])
         return self._content
 
     def get_size(self) -> int:
@@ -74,12 +74,16 @@ class ExecChunk:
     - err: error output
     """
 
+    __slots__ = ("type", "content")
+
     type: t.Literal["txt", "img", "err"]
     content: str
 
 
 @dataclass
 class ExecResult:
+    __slots__ = ("chunks",)
+
     chunks: list[ExecChunk]
 
     @property
@@ -1,14 +1,20 @@
+import asyncio
+import io
 import os
 import signal
+import sys
 import typing as t
 from contextlib import asynccontextmanager, contextmanager
-from functools import partial, reduce, wraps
+from copy import copy
+from functools import lru_cache, partial, wraps
 from importlib.metadata import PackageNotFoundError, distribution
+from pathlib import Path
 from warnings import warn
 
 import anyio
 import typing_extensions as te
 from anyio._core._eventloop import threadlocals
+from anyio.lowlevel import RunVar
 
 if t.TYPE_CHECKING:
     from .types import ExecChunk, ExecResult
@@ -35,15 +41,62 @@ def deprecated(message: str) -> t.Callable[[t.Callable[P, T]], t.Callable[P, T]]
     return decorator
 
 
+@lru_cache(maxsize=128)
+def _read_code(path: str, mtime_ns: int, size: int) -> str:
+    return Path(path).read_text(encoding="utf-8")
+
+
 def resolve_pathlike(file: t.Union[str, os.PathLike]) -> str:
     if isinstance(file, os.PathLike):
-        with open(file, "r") as f:
-            return f.read()
+        path = os.path.abspath(file)
+        stat = os.stat(path)
+        # keyed by mtime and size so an edited script is read again
+        return _read_code(path, stat.st_mtime_ns, stat.st_size)
     return file
 
 
+class _ChunkReader(io.RawIOBase):
+    def __init__(self, chunks: t.Iterable[bytes]) -> None:
+        self._chunks = iter(chunks)
+        self._pending = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: t.Any) -> int:
+        while not self._pending:
+            try:
+                self._pending = memoryview(next(self._chunks))
+            except StopIteration:
+                return 0
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+
+def iter_as_file(chunks: t.Iterable[bytes]) -> t.BinaryIO:
+    """Wrap an iterable of byte chunks into a read-only file object."""
+    return t.cast(t.BinaryIO, io.BufferedReader(_ChunkReader(chunks)))
+
+
+try:
+    import orjson
+
+    def json_dumps(obj: t.Any) -> bytes:
+        """Serialize to JSON bytes, using orjson since it is installed."""
+        return orjson.dumps(obj)
+
+except ImportError:
+    import json
+
+    def json_dumps(obj: t.Any) -> bytes:
+        """Serialize to JSON bytes, compact stdlib json without orjson."""
+        return json.dumps(obj, separators=(",", ":")).encode()
+
+
 def reduce_bytes(async_gen: t.Iterator[bytes]) -> bytes:
-    return reduce(lambda x, y: x + y, async_gen)
+    return b"".join(async_gen)
 
 
 def flatten_exec_result(
@@ -91,18 +144,109 @@ def syncify(
 
     @wraps(async_function)
     def wrapper(*args: P.args, **kwargs: P.kwargs) -> T:
-        partial_f = partial(async_function, *args, **kwargs)
+        return run_sync(async_function, *args, **kwargs)
+
+    return wrapper
+
+
+def run_sync(
+    async_function: t.Callable[P, t.Coroutine[t.Any, t.Any, T]],
+    *args: P.args,
+    **kwargs: P.kwargs,
+) -> T:
+    """
+    Call the async function like `syncify` does, without building a wrapper first.
+    """
+    partial_f = partial(async_function, *args, **kwargs)
+
+    if not getattr(threadlocals, "current_async_backend", None):
+        return anyio.run(_run_and_close, partial_f)
+    return anyio.from_thread.run(partial_f)
+
+
+_sync_run_closers: RunVar[list[t.Callable[[], t.Awaitable[t.Any]]]] = RunVar(
+    "codebox_sync_run_closers"
+)
+
+
+async def _run_and_close(async_function: t.Callable[[], t.Awaitable[T]]) -> T:
+    closers: list[t.Callable[[], t.Awaitable[t.Any]]] = []
+    _sync_run_closers.set(closers)
+    try:
+        return await async_function()
+    finally:
+        for aclose in reversed(closers):
+            await aclose()
+
+
+def close_after_sync_run(aclose: t.Callable[[], t.Awaitable[t.Any]]) -> bool:
+    """
+    Await `aclose` when the event loop started by `run_sync` finishes.
+    Returns False when the current loop was not started by `run_sync`.
+    """
+    if (closers := _sync_run_closers.get(None)) is None:
+        return False
+    closers.append(aclose)
+    return True
+
 
-        if not getattr(threadlocals, "current_async_backend", None):
-            return anyio.run(partial_f)
-        return anyio.from_thread.run(partial_f)
+class _Flight(t.Generic[T]):
+    __slots__ = ("done", "finished", "result", "error")
+
+    def __init__(self) -> None:
+        self.done = anyio.Event()
+        self.finished = False
+        self.result: t.Optional[T] = None
+        self.error: t.Optional[Exception] = None
+
+
+def single_flight(
+    async_function: t.Callable[P, t.Coroutine[t.Any, t.Any, T]],
+) -> t.Callable[P, t.Coroutine[t.Any, t.Any, T]]:
+    """
+    Deduplicate concurrent calls with the same arguments so they share one in-flight
+    execution instead of each issuing their own request.
+    Only use this for idempotent (read-only) operations. Waiting callers get a
+    shallow copy of the result.
+    """
+    inflight: RunVar[dict[tuple, _Flight[T]]] = RunVar(async_function.__qualname__)
+
+    @wraps(async_function)
+    async def wrapper(*args: P.args, **kwargs: P.kwargs) -> T:
+        if (flights := inflight.get(None)) is None:
+            flights = {}
+            inflight.set(flights)
+        key = (args, tuple(sorted(kwargs.items())))
+        if (flight := flights.get(key)) is not None:
+            await flight.done.wait()
+            if not flight.finished:
+                # the caller running it was cancelled, so run it again
+                return await wrapper(*args, **kwargs)
+            if flight.error is not None:
+                raise flight.error
+            # a copy per caller, so changing one result does not change the others
+            return copy(t.cast(T, flight.result))
+
+        flight = flights[key] = _Flight()
+        try:
+            result = flight.result = await async_function(*args, **kwargs)
+            flight.finished = True
+            return result
+        except Exception as e:
+            flight.error, flight.finished = e, True
+            raise
+        finally:
+            del flights[key]
+            flight.done.set()
 
     return wrapper
 
 
+@lru_cache(maxsize=None)
 def check_installed(package: str) -> None:
     """
     Check if the given package is installed.
+    Successful lookups are cached, a missing package is looked up again.
     """
     try:
         distribution(package)
@@ -134,18 +278,35 @@ def raise_timeout(timeout: t.Optional[float] = None):
 
 @asynccontextmanager
 async def async_raise_timeout(timeout: t.Optional[float] = None):
-    def timeout_handler(signum, frame):
-        raise TimeoutError("Execution timed out")
-
-    if timeout is not None:
-        signal.signal(signal.SIGALRM, timeout_handler)
-        signal.alarm(int(timeout))
-
+    if timeout is None:
+        yield
+        return
+
+    loop = asyncio.get_running_loop()
+    task = asyncio.current_task()
+    assert task is not None
+    timed_out = False
+
+    def timeout_handler() -> None:
+        nonlocal timed_out
+        timed_out = True
+        task.cancel()
+
+    # handled by the loop, raising from a plain signal handler would
+    # interrupt the event loop itself instead of the running task
+    loop.add_signal_handler(signal.SIGALRM, timeout_handler)
+    signal.alarm(int(timeout))
     try:
         yield
+    except asyncio.CancelledError:
+        if not timed_out:
+            raise
+        if sys.version_info >= (3, 11):
+            task.uncancel()
+        raise TimeoutError("Execution timed out") from None
     finally:
-        if timeout is not None:
-            signal.alarm(0)
+        signal.alarm(0)
+        loop.remove_signal_handler(signal.SIGALRM)
 
 
 @contextmanager
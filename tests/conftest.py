@@ -1,4 +1,6 @@
 import os
+import socket
+from functools import lru_cache
 
 import pytest
 from dotenv import load_dotenv
@@ -10,6 +12,14 @@ LOCALBOX = CodeBox(api_key="local")
 load_dotenv()
 
 
+@lru_cache(maxsize=1)
+def docker_running() -> bool:
+    if os.getenv("DOCKER_HOST") or not hasattr(socket, "AF_UNIX"):
+        return os.system("docker ps > /dev/null 2>&1") == 0
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        return s.connect_ex("/var/run/docker.sock") == 0
+
+
 @pytest.fixture(
     scope="session",
     params=["local", "docker", os.getenv("CODEBOX_API_KEY")],
@@ -19,8 +29,7 @@ def codebox(request: pytest.FixtureRequest) -> CodeBox:
         return LOCALBOX
 
     if request.param == "docker" and (
-        os.system("docker ps > /dev/null 2>&1") != 0
-        or os.getenv("GITHUB_ACTIONS") == "true"
+        not docker_running() or os.getenv("GITHUB_ACTIONS") == "true"
     ):
         pytest.skip("Docker is not running")
 
@@ -1,3 +1,6 @@
+import asyncio
+import shutil
+import subprocess
 import time
 
 import pytest
@@ -143,6 +146,139 @@ async def test_async_list_operations(codebox: CodeBox):
     )
 
 
+@pytest.mark.asyncio
+async def test_async_show_variables_values(codebox: CodeBox):
+    await codebox.aexec(
+        "v_int = 42; v_float = 1.5; v_none = None; v_dict = {'a': [1, 2]}\n"
+        "v_text = 'line one\\nline\\x1etwo\\x1f \"quoted\" ü'"
+    )
+    variables = await codebox.ashow_variables()
+    assert variables["v_int"] == "42"
+    assert variables["v_float"] == "1.5"
+    assert variables["v_none"] == "None"
+    assert variables["v_dict"] == "{'a': [1, 2]}"
+    assert variables["v_text"] == 'line one\nline\x1etwo\x1f "quoted" ü', (
+        "Values with separators, quotes and newlines should come back unchanged"
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("via_stat", [False, True], ids=["box", "stat"])
+async def test_async_download_size(codebox: CodeBox, via_stat: bool):
+    # via_stat runs the generic `stat -c %s` implementation on any box
+    adownload = CodeBox.adownload.__get__(codebox) if via_stat else codebox.adownload
+    await codebox.aupload("name with spaces.txt", b"12345")
+    remote_file = await adownload("name with spaces.txt")
+    assert remote_file.path == "name with spaces.txt"
+    assert remote_file._size == 5, "Paths with spaces should be quoted for stat"
+
+    with pytest.raises(FileNotFoundError):
+        await adownload("missing file.txt")
+
+
+def test_sync_upload_iterable(codebox: CodeBox):
+    chunks = (chunk for chunk in [b"Hello ", b"from ", b"chunks!"])
+    codebox.upload("iterable.txt", chunks)
+    assert codebox.download("iterable.txt").get_content() == b"Hello from chunks!", (
+        "Uploading an iterable should write all of its chunks"
+    )
+
+
+@pytest.mark.asyncio
+async def test_async_upload_iterable(codebox: CodeBox):
+    chunks = (chunk for chunk in [b"Hello ", b"from ", b"chunks!"])
+    await codebox.aupload("iterable.txt", chunks)
+    remote_file = await codebox.adownload("iterable.txt")
+    assert await remote_file.aget_content() == b"Hello from chunks!", (
+        "Uploading an iterable should write all of its chunks"
+    )
+
+
+@pytest.mark.asyncio
+async def test_async_concurrent_list_files(
+    codebox: CodeBox, monkeypatch: pytest.MonkeyPatch
+):
+    await codebox.aupload("concurrent.txt", b"concurrent")
+    calls = 0
+    aexec, list_files = codebox.aexec, codebox.list_files
+
+    async def counting_aexec(*args, **kwargs):
+        nonlocal calls
+        calls += 1
+        return await aexec(*args, **kwargs)
+
+    def counting_list_files():
+        nonlocal calls
+        calls += 1
+        return list_files()
+
+    monkeypatch.setattr(codebox, "aexec", counting_aexec)
+    monkeypatch.setattr(codebox, "list_files", counting_list_files)
+    first, second = await asyncio.gather(codebox.alist_files(), codebox.alist_files())
+    assert calls == 1, "Concurrent list_files calls should share one backend call"
+    assert [f.path for f in first] == [f.path for f in second], (
+        "Concurrent list_files calls should return the same listing"
+    )
+    assert "concurrent.txt" in [f.path for f in first]
+
+
+@pytest.mark.asyncio
+async def test_single_flight_waiters():
+    from codeboxapi.utils import single_flight
+
+    calls = 0
+
+    @single_flight
+    async def fetch(kind: str) -> list[str]:
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        if kind == "error":
+            raise ValueError("backend failed")
+        return ["file.txt"]
+
+    first, second = await asyncio.gather(fetch("ok"), fetch("ok"))
+    assert calls == 1, "Concurrent calls should share one execution"
+    first.append("changed.txt")
+    assert second == ["file.txt"], "Each waiter should get its own result"
+
+    errors = await asyncio.gather(
+        fetch("error"), fetch("error"), return_exceptions=True
+    )
+    assert calls == 2
+    assert all(isinstance(e, ValueError) for e in errors), (
+        "An error should reach every waiter"
+    )
+
+    leader = asyncio.create_task(fetch("ok"))
+    await asyncio.sleep(0)
+    waiter = asyncio.create_task(fetch("ok"))
+    await asyncio.sleep(0)
+    leader.cancel()
+    assert await waiter == ["file.txt"], "A cancelled leader should not fail waiters"
+    assert leader.cancelled()
+    assert calls == 4, "The waiter should run the call again after a cancellation"
+
+
+def test_resolve_pathlike_rereads_changed_file(tmp_path):
+    import os
+
+    from codeboxapi.utils import resolve_pathlike
+
+    script = tmp_path / "script.py"
+    script.write_text("print(1)")
+    assert resolve_pathlike(script) == "print(1)"
+    assert resolve_pathlike(script) == "print(1)", "Unchanged files come from cache"
+
+    script.write_text("print(22)")
+    assert resolve_pathlike(script) == "print(22)", "A new size should be read again"
+
+    mtime_ns = script.stat().st_mtime_ns
+    script.write_text("print(33)")
+    os.utime(script, ns=(mtime_ns + 1_000_000, mtime_ns + 1_000_000))
+    assert resolve_pathlike(script) == "print(33)", "A new mtime should be read again"
+
+
 def test_sync_stream_exec(codebox: CodeBox):
     chunks: list[tuple[ExecChunk, float]] = []
     t0 = time.perf_counter()
@@ -272,6 +408,55 @@ async def test_async_stream_exec_bash(codebox: CodeBox):
     ), "At least some chunks should have noticeable delay between them"
 
 
+BASH_STDOUT_STDERR = (
+    "for i in 1 2; do echo out$i; sleep 0.05; echo err$i >&2; sleep 0.05; done"
+)
+BASH_STDOUT_STDERR_CHUNKS = [
+    ("txt", "out1"),
+    ("err", "err1"),
+    ("txt", "out2"),
+    ("err", "err2"),
+]
+
+
+def test_sync_stream_exec_bash_stderr(codebox: CodeBox):
+    chunks = codebox.stream_exec(BASH_STDOUT_STDERR, kernel="bash")
+    assert [(c.type, c.content.strip()) for c in chunks] == BASH_STDOUT_STDERR_CHUNKS, (
+        "stdout and stderr chunks should keep their type and order"
+    )
+
+    received = []
+    t0 = time.perf_counter()
+    with pytest.raises(TimeoutError):
+        for chunk in codebox.stream_exec(
+            "echo start; sleep 5; echo end", kernel="bash", timeout=1
+        ):
+            received.append(chunk.content.strip())
+    assert received == ["start"], "Output before the timeout should be streamed"
+    assert time.perf_counter() - t0 < 4, "The timeout should stop the command"
+
+
+@pytest.mark.asyncio
+async def test_async_stream_exec_bash_stderr(codebox: CodeBox):
+    chunks = [
+        (c.type, c.content.strip())
+        async for c in codebox.astream_exec(BASH_STDOUT_STDERR, kernel="bash")
+    ]
+    assert chunks == BASH_STDOUT_STDERR_CHUNKS, (
+        "stdout and stderr chunks should keep their type and order"
+    )
+
+    received = []
+    t0 = time.perf_counter()
+    with pytest.raises(TimeoutError):
+        async for chunk in codebox.astream_exec(
+            "echo start; sleep 5; echo end", kernel="bash", timeout=1
+        ):
+            received.append(chunk.content.strip())
+    assert received == ["start"], "Output before the timeout should be streamed"
+    assert time.perf_counter() - t0 < 4, "The timeout should stop the command"
+
+
 def test_sync_error_handling(codebox: CodeBox):
     result = codebox.exec("1/0")
     assert result.errors, "Execution should produce an error"
@@ -333,6 +518,22 @@ async def test_file_from_url_async(codebox: CodeBox):
     assert file_path in [file.path for file in await codebox.alist_files()]
 
 
+@pytest.mark.asyncio
+async def test_local_install_skips_only_bare_names(monkeypatch):
+    installed: list[str] = []
+
+    async def fake_install(self, *packages: str) -> str:
+        installed.extend(packages)
+        return " ".join(packages) + " installed successfully"
+
+    monkeypatch.setattr(CodeBox, "ainstall", fake_install)
+    codebox = CodeBox(api_key="local")
+    await codebox.ainstall("pytest", "pytest>=7", "pytest[testing]")
+    assert installed == ["pytest>=7", "pytest[testing]"], (
+        "Specs with a version or extras should still be passed to pip"
+    )
+
+
 def test_local_box_singleton():
     from codeboxapi.local import LocalBox
 
@@ -341,10 +542,215 @@ def test_local_box_singleton():
 
     assert "Only one LocalBox instance can exist at a time" in str(exc_info.value)
 
-    with pytest.raises(RuntimeError) as exc_info:
-        _ = CodeBox(api_key="local")
+    assert CodeBox(api_key="local") is CodeBox(api_key="local")
+    with pytest.warns(UserWarning, match="codebox_cwd='.other' is ignored"):
+        CodeBox(api_key="local", codebox_cwd=".other")
+
+
+def _mock_remote(handler) -> CodeBox:
+    import httpx
+
+    from codeboxapi.remote import RemoteBox
+
+    transport = httpx.MockTransport(handler)
+    return RemoteBox(
+        api_key="test",
+        base_url="http://codebox.test",
+        client=httpx.Client(transport=transport),
+        aclient=httpx.AsyncClient(transport=transport),
+    )
+
+
+def test_remote_exec_not_retried_on_504(monkeypatch):
+    import httpx
+    from tenacity import wait_none
+
+    from codeboxapi.remote import RemoteBox
+
+    monkeypatch.setattr(RemoteBox._open_stream.retry, "wait", wait_none())
+    calls: list[str] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request.method)
+        return httpx.Response(504)
+
+    codebox = _mock_remote(handler)
+    with pytest.raises(httpx.HTTPStatusError):
+        codebox.exec("print('once')")
+    assert calls == ["POST"], "A 504 on exec may have run the code, no retry"
+
+    calls.clear()
+    with pytest.raises(httpx.HTTPStatusError):
+        list(codebox.stream_download("file.txt"))
+    assert calls == ["GET"] * 3, "Downloads are safe to retry on a 504"
+
+
+@pytest.mark.asyncio
+async def test_remote_upload_retry(monkeypatch):
+    import io
+
+    import httpx
+    from tenacity import retry, retry_if_exception, stop_after_attempt
+
+    from codeboxapi import remote
+
+    monkeypatch.setattr(
+        remote,
+        "retry_on_gateway_error",
+        retry(
+            retry=retry_if_exception(remote._is_retryable),
+            stop=stop_after_attempt(3),
+            reraise=True,
+        ),
+    )
+    bodies: list[bytes] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        bodies.append(request.read())
+        return httpx.Response(503 if len(bodies) == 1 else 200)
+
+    codebox = _mock_remote(handler)
+    codebox.upload("file.txt", io.BytesIO(b"file content"))
+    assert len(bodies) == 2, "A 503 on upload should be retried"
+    assert b"file content" in bodies[1], "The file should be rewound for the retry"
+
+    bodies.clear()
+    await codebox.aupload("file.txt", io.BytesIO(b"file content"))
+    assert len(bodies) == 2 and b"file content" in bodies[1]
 
-    assert "codeboxapi.com" in str(exc_info.value)
+    bodies.clear()
+    with pytest.raises(httpx.HTTPStatusError):
+        codebox.upload("file.txt", (chunk for chunk in [b"file ", b"content"]))
+    assert len(bodies) == 1, "Iterable content can only be sent once"
+
+
+@pytest.mark.asyncio
+async def test_remote_download_head():
+    import httpx
+
+    requests: list[str] = []
+    head_status = 200
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request.method)
+        if request.method == "HEAD":
+            return httpx.Response(head_status, headers={"Content-Length": "5"})
+        return httpx.Response(200, text="<txt>7</txt>")
+
+    codebox = _mock_remote(handler)
+    remote_file = await codebox.adownload("file.txt")
+    assert remote_file._size == 5, "The size should come from the HEAD response"
+    assert requests == ["HEAD"]
+
+    requests.clear()
+    head_status = 404
+    with pytest.raises(FileNotFoundError):
+        await codebox.adownload("missing.txt")
+    assert requests == ["HEAD"], "A 404 should not fall back to exec"
+
+    requests.clear()
+    head_status = 405
+    assert (await codebox.adownload("file.txt"))._size == 7
+    assert (await codebox.adownload("file.txt"))._size == 7
+    assert requests == ["HEAD", "POST", "POST"], (
+        "After a 405 the box should skip HEAD and use exec"
+    )
+
+
+@pytest.mark.asyncio
+async def test_shared_aclient_closed_with_last_box():
+    from codeboxapi.remote import RemoteBox
+
+    first, second = RemoteBox(api_key="test"), RemoteBox(api_key="test")
+    aclient = first.aclient
+    assert second.aclient is aclient, "Boxes on one loop should share the client"
+
+    await first.aclose()
+    assert not aclient.is_closed, "The client is still used by the second box"
+    await second.aclose()
+    assert aclient.is_closed, "Closing the last box should close the client"
+
+
+@pytest.mark.asyncio
+async def test_keep_alive_pings_after_idle(monkeypatch):
+    import types
+
+    import anyio
+    import httpx
+
+    from codeboxapi import codebox as codebox_module
+    from codeboxapi import remote
+
+    now = 0.0
+    requests: list[tuple[float, str]] = []
+    clock = types.SimpleNamespace(monotonic=lambda: now)
+    monkeypatch.setattr(codebox_module, "time", clock)
+    monkeypatch.setattr(remote, "time", clock)
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append((now, request.url.path.rsplit("/", 1)[-1]))
+        return httpx.Response(200, text="<txt>ok</txt>")
+
+    codebox = _mock_remote(handler)
+
+    async def fake_sleep(seconds: float) -> None:
+        nonlocal now
+        if now == 0:
+            # any other request resets the idle time of the keep-alive
+            now = 30
+            await codebox.aupload("activity.txt", b"activity")
+            seconds -= 30
+        now += seconds
+        await anyio.lowlevel.checkpoint()
+
+    monkeypatch.setattr(anyio, "sleep", fake_sleep)
+    await codebox.akeep_alive(minutes=3)
+    assert requests == [
+        (0, "exec"),
+        (30, "upload"),
+        (90, "exec"),
+        (150, "exec"),
+    ], "Pings should only be sent after a full interval without requests"
+    assert codebox._keep_alive is None
+
+
+@pytest.mark.asyncio
+async def test_keep_alive_closed_from_another_thread():
+    import anyio
+    import httpx
+
+    codebox = _mock_remote(lambda _: httpx.Response(200, text="<txt>ok</txt>"))
+    with anyio.fail_after(5):
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(codebox.akeep_alive)
+            while codebox._keep_alive is None:
+                await anyio.sleep(0.01)
+            await anyio.to_thread.run_sync(codebox.close)
+    assert codebox._keep_alive is None, "close() should stop the keep-alive"
+
+
+def _running_containers() -> set[str]:
+    ps = subprocess.run(
+        ["docker", "ps", "-q", "--no-trunc"], capture_output=True, text=True
+    )
+    return set(ps.stdout.split())
+
+
+def test_docker_box_container_lifecycle():
+    if shutil.which("docker") is None or subprocess.call(
+        ["docker", "ps"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    ):
+        pytest.skip("Docker is not running")
+
+    before = _running_containers()
+    codebox = CodeBox(api_key="docker")
+    assert _running_containers() - before == {codebox.container_id}, (
+        "Creating a DockerBox should start exactly one container"
+    )
+    codebox.close()
+    assert _running_containers() <= before, (
+        "Closing the DockerBox should stop its container"
+    )
 
 
 if __name__ == "__main__":